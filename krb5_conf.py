@@ -3,6 +3,7 @@
 # This is used in crypto-policies's test suite.  Before making changes, be
 # sure it won't break them.
 
+import hashlib
 import os
 import re
 import subprocess
@@ -31,9 +32,15 @@ ACCEPTED_ENCTYPES = [
 
 min_ver = None
 
+# Raised for anything wrong with the configuration (or with reading it).
+# Nothing is cached on failure, so callers can catch this and carry on.
+class ConfigError(Exception):
+    def __init__(self, s, prefix):
+        super().__init__("%s: %s" % (prefix, s))
+        self.prefix = prefix
+
 def error(s, prefix):
-    print("%s: %s" % (prefix, s), file=sys.stderr)
-    exit(1)
+    raise ConfigError(s, prefix)
 
 def by_section(lines, prefix):
     secs = {}
@@ -66,7 +73,9 @@ def merge(parent, child, prefix):
 
     return parent
 
-def get_clean_contents(f, prefix=None):
+# With includes_first, included files' sections come before this file's own,
+# which is the order libkrb5 reads them in.
+def get_clean_contents(f, prefix=None, includes_first=False):
     prefix = f if prefix is None else prefix + ": " + f
 
     try:
@@ -75,25 +84,34 @@ def get_clean_contents(f, prefix=None):
         error(e, prefix)
 
     lines = data.replace("\r\n", "\n").split("\n")
-    lines = [line.strip() for line in lines
-             if not line.startswith("#") and len(line.strip()) > 0]
+    lines = [line.strip() for line in lines]
+    lines = [line for line in lines
+             if len(line) > 0 and not line.startswith(("#", ";"))]
 
     extra = []
-    while lines[0].startswith("include"):
+    # An empty file (or one that's only includes) is fine.
+    while len(lines) > 0 and lines[0].startswith("include"):
         m = re.match(r"(include|includedir)\s+(.*)", lines[0])
+        if m is None:
+            error("malformed include directive: " + lines[0], prefix)
         verb = m.group(1)
         path = m.group(2).strip()
 
         if verb == "include":
-            extra.append(get_clean_contents(path, prefix))
+            extra.append(get_clean_contents(path, prefix, includes_first))
         elif verb == "includedir":
-            for nf in os.listdir(path):
+            try:
+                names = os.listdir(path)
+            except Exception as e:
+                error(e, prefix)
+
+            for nf in names:
                 if not nf.endswith(".conf") \
                    and re.search("[^a-zA-Z0-9_-]", nf) is not None:
                     error("file ignored by libkrb5: " + nf, prefix)
 
                 nf = os.path.join(path, nf)
-                extra.append(get_clean_contents(nf, prefix))
+                extra.append(get_clean_contents(nf, prefix, includes_first))
 
         else:
             error("unrecognized include directive: " + verb, prefix)
@@ -101,6 +119,8 @@ def get_clean_contents(f, prefix=None):
         del(lines[0])
 
     secs = by_section(lines, prefix)
+    if includes_first:
+        extra, secs = extra + [secs], {}
     for d in extra:
         secs = merge(secs, d, prefix)
     return secs
@@ -116,9 +136,8 @@ def first_level(lines):
 
     return tup_list
 
-def second_level(lines):
-    secs = {}
-
+# Yields (header, relation lines) for each stanza, in order.
+def stanzas(lines):
     while len(lines) > 0:
         m = re.match(r"(.*?)\s*=\s*{", lines[0])
         if m is None:
@@ -126,13 +145,19 @@ def second_level(lines):
 
         del(lines[0])
         attrs = []
-        while lines[0] != "}":
+        while len(lines) > 0 and lines[0] != "}":
             attrs.append(lines[0])
             del(lines[0])
+        if len(lines) == 0:
+            error("unterminated stanza: " + m.group(1), "(parsing)")
 
-        secs[m.group(1)] = to_dict(first_level(attrs), True)
+        yield m.group(1), attrs
         del(lines[0])
 
+def second_level(lines):
+    secs = {}
+    for header, attrs in stanzas(lines):
+        secs[header] = to_dict(first_level(attrs), True)
     return secs
 
 def to_dict(tuplist, dups_okay=False):
@@ -143,7 +168,6 @@ def to_dict(tuplist, dups_okay=False):
             d[k] += [v]
             continue
         elif k in d:
-            print(tuplist)
             error("duplicate assignment: " + k, "(parsing)")
 
         d[k] = v
@@ -161,6 +185,26 @@ def parse(f):
 
     return sections
 
+# As libkrb5 sees a configuration: includes are read first, a stanza repeated
+# (for instance, across krb5.conf.d snippets) is one stanza, and every
+# relation is the ordered list of its values - in flat sections too, where
+# the first one wins.
+def parse_merged(f):
+    sections = get_clean_contents(f, includes_first=True)
+    for s in sections.keys():
+        if s not in STANZA_SECTIONS:
+            sections[s] = to_dict(first_level(sections[s]), True)
+            continue
+
+        merged = {}
+        for header, attrs in stanzas(sections[s]):
+            relations = merged.setdefault(header, defaultdict(list))
+            for k, v in first_level(attrs):
+                relations[k].append(v)
+        sections[s] = {h: dict(r) for h, r in merged.items()}
+
+    return sections
+
 def krb5_min_ver():
     global min_ver
     if min_ver is not None:
@@ -243,19 +287,146 @@ def pretty_print(secs):
 
         print("")
 
+# Semantic diffs.  Both sides are reduced to content hashes per section,
+# stanza, and relation, so identical subtrees are skipped without looking
+# inside them.  Comments, whitespace, and the order of sections, stanzas, and
+# relation names are ignored, as they are by libkrb5; the order of values for
+# a repeated relation is kept, since libkrb5 treats that as preference.
+#
+# A hashed node is (digest, children), where children is a dict of name to
+# hashed node, or the relation's values at the leaves.  Configurations are
+# read with parse_merged(), so includes are merged as libkrb5 merges them.
+# Hashing the baseline once and passing the result to diff() for each host
+# avoids re-parsing it.
+
+def digest(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def hash_node(children):
+    parts = []
+    for name in sorted(children.keys()):
+        parts += [name, children[name][0]]
+    return (digest(parts), children)
+
+def hash_config(secs):
+    hashed = {}
+    for sec, body in secs.items():
+        if sec in STANZA_SECTIONS:
+            hashed_stanzas = {}
+            for header, relations in body.items():
+                hashed_stanzas[header] = hash_node(
+                    {k: (digest(v), v) for k, v in relations.items()})
+            hashed[sec] = hash_node(hashed_stanzas)
+            continue
+
+        hashed[sec] = hash_node({k: (digest(v), v) for k, v in body.items()})
+
+    return hash_node(hashed)
+
+def diff_nodes(old, new, path, out):
+    if old[0] == new[0]:
+        return
+
+    old_children, new_children = old[1], new[1]
+    if isinstance(old_children, list) or isinstance(new_children, list):
+        out.append(("changed", path, old_children, new_children))
+        return
+
+    for name in sorted(old_children.keys() - new_children.keys()):
+        out.append(("removed", path + [name], old_children[name][1], None))
+    for name in sorted(new_children.keys() - old_children.keys()):
+        out.append(("added", path + [name], None, new_children[name][1]))
+    for name in sorted(old_children.keys() & new_children.keys()):
+        diff_nodes(old_children[name], new_children[name], path + [name],
+                   out)
+
+# Returns a list of (kind, path, old, new) tuples; kind is one of "added",
+# "removed", or "changed".  Takes the output of hash_config().
+def diff(old, new):
+    out = []
+    diff_nodes(old, new, [], out)
+    return out
+
+def format_change(path, value):
+    ret = "[%s]" % path[0]
+    if len(path) > 1:
+        ret += " " + " ".join(path[1:])
+
+    # Whole sections and stanzas are named, not spelled out.
+    if isinstance(value, list):
+        ret += " = " + ", ".join(value)
+    return ret
+
+def print_diff(changes):
+    for kind, path, old, new in changes:
+        if kind == "added":
+            print("+ %s" % format_change(path, new))
+        elif kind == "removed":
+            print("- %s" % format_change(path, old))
+        else:
+            print("~ %s -> %s" % (format_change(path, old),
+                                  ", ".join(new)))
+
 ######
 
+# Some ConfigErrors (those from parsing relations) don't name the file, and
+# other exceptions never do.
+def report_failure(f, e):
+    msg = str(e)
+    if not msg.startswith(f + ":"):
+        msg = "%s: %s" % (f, msg)
+    print(msg, file=sys.stderr)
+
+def diff_main(baseline, files):
+    try:
+        base = hash_config(parse_merged(baseline))
+    except Exception as e:
+        report_failure(baseline, e)
+        exit(2)
+
+    ret = 0
+    for f in files:
+        # Anything going wrong is still just this file failing.
+        try:
+            changes = diff(base, hash_config(parse_merged(f)))
+        except Exception as e:
+            report_failure(f, e)
+            ret = 2
+            continue
+
+        if len(changes) == 0:
+            continue
+
+        ret = max(ret, 1)
+        print("--- %s" % f)
+        print_diff(changes)
+
+    exit(ret)
+
 if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == "--diff":
+        diff_main(sys.argv[2], sys.argv[3:])
+
     if len(sys.argv) > 1 and not os.path.exists(sys.argv[1]):
         print("Usage: %s [file [file ...]]" % sys.argv[0])
+        print("       %s --diff baseline file [file ...]" % sys.argv[0])
         print("")
         print("Verify and pretty-print krb5 configuration")
         print("By default, checks /etc/krb5.conf")
+        print("With --diff, reports semantic differences from baseline")
         exit(1)
 
     files = ["/etc/krb5.conf"] if len(sys.argv) == 1 else sys.argv[1:]
 
     for f in files:
-        out = parse(f)
-        check(out, ACCEPTED_ENCTYPES)
+        try:
+            out = parse(f)
+            check(out, ACCEPTED_ENCTYPES)
+        except ConfigError as e:
+            print(e, file=sys.stderr)
+            exit(1)
         pretty_print(out)
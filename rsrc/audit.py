@@ -0,0 +1,218 @@
+# The checks themselves, as a library.  Each audit_*() function yields
+# Finding objects rather than printing, and raises AuditError (or, for
+# unreadable configuration, KRB5Error) rather than exiting, so it's safe to
+# call repeatedly from a long-running process.  check.py renders the results.
+
+import re
+import subprocess
+
+from enctypes import PolicySet, check_etlist, ensure_hasgood
+from findings import AuditError, Finding
+from kdb import BadKeys, kadmin_princs
+from profile import KRB5Error, KRB5Profile
+
+from typing import Iterable, Iterator, Optional, Tuple
+
+# This has been true since 1.14, though man pages don't reflect it.
+defkeysalts = "aes256-cts-hmac-sha1-96:normal aes128-cts-hmac-sha1-96:normal"
+
+# Prior to 1.18, this includes 1DES.  This is upstreams, so it includes 3DES.
+defetypes = " ".join(["aes256-cts-hmac-sha1-96", "aes128-cts-hmac-sha1-96",
+                      "aes256-cts-hmac-sha384-192",
+                      "aes128-cts-hmac-sha256-128", "des3-cbc-sha1",
+                      "arcfour-hmac-md5", "camellia256-cts-cmac",
+                      "camellia128-cts-cmac"])
+
+# True since 1.11, prior to which it was 3DES.
+defmkey = "aes256-cts-hmac-sha1-96"
+
+# Configured values come in as strings; anything unparseable is the
+# configuration's fault, so it's reported as such rather than as a crash.
+def dh_bits(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise AuditError(f"Bad value for pkinit_dh_min_bits: {value}")
+
+def get_dh_bits(prof: KRB5Profile, section: str) -> int:
+    try:
+        return int(prof.get_integer(section, "pkinit_dh_min_bits", None,
+                                    2048))
+    except KRB5Error:
+        value = prof.get_string(section, "pkinit_dh_min_bits")
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        raise AuditError(f"Bad value for pkinit_dh_min_bits: {value}")
+
+def weak_dh(dh_min_values: Iterable[int]) -> Iterator[Finding]:
+    # default is 2048, which is considered fine for now
+    for v in dh_min_values:
+        if v < 2048:
+            yield Finding("weak-dh", f"Weak value for pkinit_dh_min_bits: {v}",
+                          "pkinit_dh_min_bits")
+
+# prof may be shared across calls; nothing here modifies it.  policies, here
+# and below, defaults to enctypes.default_policies.
+def audit_client(prof: KRB5Profile,
+                 policies: Optional[PolicySet] = None) -> Iterator[Finding]:
+    allow_weak_crypto = prof.get_bool("libdefaults", "allow_weak_crypto",
+                                      default=0)
+    if allow_weak_crypto:
+        yield Finding("weak-crypto-allowed",
+                      "allow_weak_crypto enabled (turns on very broken "
+                      "cryptography)", "allow_weak_crypto")
+
+    permitted_enctypes = prof.get_string("libdefaults", "permitted_enctypes",
+                                         default=defetypes)
+    yield from check_etlist(permitted_enctypes, "permitted_enctypes",
+                            policies)
+
+    # Prior to 1.18, these default to defetypes, not permitted_enctypes
+    tgs = prof.get_string("libdefaults", "default_tgs_enctypes")
+    if tgs:
+        yield from check_etlist(tgs, "default_tgs_enctypes", policies)
+
+    tkt = prof.get_string("libdefaults", "default_tkt_enctypes")
+    if tkt:
+        yield from check_etlist(tkt, "default_tkt_enctypes", policies)
+
+    # PKINIT-related values can be set in five different places - three in
+    # krb5.conf, and two in kdc.conf.
+    dh_min_values = set()
+    dh_3 = get_dh_bits(prof, "libdefaults")
+    if dh_3:
+        dh_min_values.add(dh_3)
+
+    # There's enough zero-conf that this being empty on the client is okay.
+    realms = prof.section("realms")
+    for realm, config in realms:
+        keys = {k for k, _ in config}
+        if not keys.isdisjoint(["v4_realm", "v4_instance_convert"]):
+            yield Finding("v4-config",
+                          f"Kerberos v4 configuration found for {realm}",
+                          realm=realm)
+
+        dh_2 = {dh_bits(v) for k, v in config if k == "pkinit_dh_min_bits"}
+        dh_min_values.update(dh_2)
+
+    # If libdefaults is empty, there'll be warnings elsewhere, but it's a
+    # valid configuration.
+    libdefaults = prof.section("libdefaults")
+    for realm, stanza in libdefaults:
+        # krb5 doesn't use uppercase for configs, and realms pretty much have
+        # to be uppercase, so this will do for now as a heiuristic.
+        if not realm.isupper():
+            continue
+
+        dh_1 = {dh_bits(v) for k, v in stanza if k == "pkinit_dh_min_bits"}
+        dh_min_values.update(dh_1)
+
+    yield from weak_dh(dh_min_values)
+
+def audit_crypto_policies() -> Iterator[Finding]:
+    try:
+        policies = subprocess.check_output(
+            ["update-crypto-policies", "--show"])[:-1]
+    except FileNotFoundError:
+        return
+
+    for policy in policies.split(b":"):
+        if policy == b"AD-SUPPORT":
+            yield Finding("weak-crypto-policy",
+                          "RC4 (weak) permitted by crypto-policies!",
+                          "AD-SUPPORT")
+        elif policy == b"LEGACY":
+            yield Finding("weak-crypto-policy",
+                          "Legacy (insecure) algorithms permitted by "
+                          "crypto-policies!", "LEGACY")
+
+# Every category princ_category() can return, in reporting order.
+CATEGORIES = ["K/M", "krbtgt", "cross-realm", "service"]
+
+tgtre = re.compile(r"krbtgt/(.*)")
+# Returns (category, description) for a principal.
+def princ_category(princ: str) -> Tuple[str, str]:
+    short, myrealm = princ.rsplit("@", 1)
+    if short == "K/M":
+        return "K/M", "the K/M principal (database master key)"
+
+    m = tgtre.match(short)
+    if not m:
+        return "service", f"the {short} principal"
+
+    destrealm = m.group(1)
+    if destrealm != myrealm:
+        return "cross-realm", f"cross-realm principal for {destrealm}"
+
+    return "krbtgt", "the krbtgt principal (ticket granting service key)"
+
+# princs is a source of (principal, keysalt list) pairs; see kdb.py.  A
+# principal that can't be checked produces an "error" finding; the scan
+# carries on with the rest.
+def audit_princs(princs: Optional[Iterable[Tuple[str, str]]] = None,
+                 policies: Optional[PolicySet] = None) -> Iterator[Finding]:
+    if princs is None:
+        princs = kadmin_princs()
+
+    for princ, kslist in princs:
+        # Nothing to check for a principal with no keys at all.
+        if kslist.strip() == "":
+            continue
+
+        category, name = princ_category(princ)
+        realm = princ.rsplit("@", 1)[-1]
+        try:
+            if isinstance(kslist, BadKeys):
+                raise AuditError(kslist)
+            findings = ensure_hasgood(kslist, name, policies)
+        except AuditError as e:
+            findings = [Finding("error", str(e))]
+
+        for f in findings:
+            yield f._replace(subject=princ, realm=realm, category=category)
+
+# Configuration checks only; run audit_princs() for the principals.
+def audit_kdc(prof: KRB5Profile,
+              policies: Optional[PolicySet] = None) -> Iterator[Finding]:
+    permitted_enctypes = prof.get_string("libdefaults", "permitted_enctypes",
+                                         default=defetypes)
+    yield from check_etlist(permitted_enctypes, "KDC permitted_enctypes",
+                            policies)
+
+    otp = prof.section("otp")
+    for toktype, stanza in otp:
+        server = [v for k, v in stanza if k == "server"]
+        if len(server) > 0 and server[0][0] != '/':
+            yield Finding("radius", f"OTP type {toktype} configures RADIUS",
+                          toktype)
+
+    # Two pkinit_dh_min_bits places on the KDC.
+    dh_min_values = set()
+    dh_4 = get_dh_bits(prof, "kdcdefaults")
+    if dh_4:
+        dh_min_values.add(dh_4)
+
+    realms = prof.section("realms")
+    if len(realms) == 0:
+        raise AuditError("No realms found checking KDC configuration")
+
+    for realm, stanza in realms:
+        has_preauth = False
+        for k, v in stanza:
+            if k == "pkinit_dh_min_bits":
+                dh_min_values.add(dh_bits(v)) # dh_5
+            elif k == "master_key_type":
+                # defaults to defmkey, so it's okay to not specify
+                for f in check_etlist(v, "master_key_type", policies):
+                    yield f._replace(realm=realm)
+            elif k == "default_principal_flags":
+                has_preauth = "+preauth" in v
+
+        if not has_preauth:
+            yield Finding("no-preauth",
+                          f"{realm} doesn't set +preauth in "
+                          "default_principal_flags",
+                          "default_principal_flags", realm)
+
+    # Same rationale as in audit_client
+    yield from weak_dh(dh_min_values)
@@ -1,184 +1,145 @@
 #!/usr/bin/python3
 
+# Command-line front end: runs the checks in audit.py and prints the results.
+
+import argparse
+import functools
+import multiprocessing
 import os
 import re
 import subprocess
 
-from enctypes import check_etlist, ensure_hasgood
-from profile import KRB5Profile
-
-from typing import List
-
-# This has been true since 1.14, though man pages don't reflect it.
-defkeysalts = "aes256-cts-hmac-sha1-96:normal aes128-cts-hmac-sha1-96:normal"
-
-# Prior to 1.18, this includes 1DES.  This is upstreams, so it includes 3DES.
-defetypes = " ".join(["aes256-cts-hmac-sha1-96", "aes128-cts-hmac-sha1-96",
-                      "aes256-cts-hmac-sha384-192",
-                      "aes128-cts-hmac-sha256-128", "des3-cbc-sha1",
-                      "arcfour-hmac-md5", "camellia256-cts-cmac",
-                      "camellia128-cts-cmac"])
-
-# True since 1.11, prior to which it was 3DES.
-defmkey = "aes256-cts-hmac-sha1-96"
-
-def check_client() -> None:
-    prof = KRB5Profile()
-
-    allow_weak_crypto = prof.get_bool("libdefaults", "allow_weak_crypto",
-                                      default=0)
-    if allow_weak_crypto:
-        print("allow_weak_crypto enabled (turns on very broken cryptography)")
-
-    permitted_enctypes = prof.get_string("libdefaults", "permitted_enctypes",
-                                         default=defetypes)
-    check_etlist(permitted_enctypes, "permitted_enctypes")
-
-    # Prior to 1.18, these default to defetypes, not permitted_enctypes
-    tgs = prof.get_string("libdefaults", "default_tgs_enctypes")
-    if tgs:
-        check_etlist(tgs, "default_tgs_enctypes")
-
-    tkt = prof.get_string("libdefaults", "default_tkt_enctypes")
-    if tkt:
-        check_etlist(tkt, "default_tkt_enctypes")
-
-    # PKINIT-related values can be set in five different places - three in
-    # krb5.conf, and two in kdc.conf.
-    dh_min_values = set()
-    dh_3 = prof.get_integer("libdefaults", "pkinit_dh_min_bits", None, 2048)
-    if dh_3:
-        dh_min_values.add(int(dh_3))
-
-    # There's enough zero-conf that this being empty on the client is okay.
-    realms = prof.section("realms")
-    for realm, config in realms:
-        keys = {k for k, _ in config}
-        if not keys.isdisjoint(["v4_realm", "v4_instance_convert"]):
-            print(f"Kerberos v4 configuration found for {realm}")
-
-        dh_2 = {int(v) for k, v in config if k == "pkinit_dh_min_bits"}
-        dh_min_values.update(dh_2)
-
-    # If libdefaults is empty, there'll be warnings elsewhere, but it's a
-    # valid configuration.
-    libdefaults = prof.section("libdefaults")
-    for realm, stanza in libdefaults:
-        # krb5 doesn't use uppercase for configs, and realms pretty much have
-        # to be uppercase, so this will do for now as a heiuristic.
-        if not realm.isupper():
-            continue
-
-        dh_1 = {int(v) for k, v in stanza if k == "pkinit_dh_min_bits"}
-        dh_min_values.update(dh_1)
-
-    # default is 2048, which is considered fine for now
-    for v in dh_min_values:
-        if v < 2048:
-            print(f"Weak value for pkinit_dh_min_bits: {v}")
-
-def kl(cmd: str) -> List[str]:
-    res = subprocess.check_output(f"kadmin.local -q '{cmd}'", shell=True)
-    decoded = res.decode('utf-8')
-    return decoded.strip().split("\n")[1:]
-
-key_re = re.compile(r"^Key: vno \d+, (.*)$")
-def get_princdata(princ: str) -> str:
-    etlist = []
-    for line in kl(f"getprinc {princ}"):
-        m = key_re.match(line)
-        if m:
-            etlist.append(m.group(1))
-
-    return " ".join(etlist)
-
-def check_crypto_policies() -> None:
+from audit import audit_client, audit_crypto_policies, audit_kdc, \
+    audit_princs
+from enctypes import PolicySet, load_policies
+from findings import AuditError, Finding
+from kdb import dump_princs, ldap_princs
+from profile import KRB5Error, KRB5Profile
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# If fatal is False, an AuditError is reported but doesn't end the run.
+# Verdicts for policies other than RHEL 8 and secure are only shown on
+# request (all_policies).
+def render(findings: Iterable[Finding], fatal: bool = True,
+           all_policies: bool = False) -> None:
+    try:
+        for f in findings:
+            if f.kind == "no-policy-keys" and not all_policies:
+                continue
+            # Errors can be about any one principal; say which.
+            if f.kind == "error" and f.subject:
+                print(f"{f.subject}: {f.message}")
+            else:
+                print(f.message)
+    except AuditError as e:
+        print(e)
+        if fatal:
+            exit(1)
+
+def check_client(policies: Optional[PolicySet] = None) -> None:
+    render(audit_client(KRB5Profile(), policies))
+
+# Runs in a pool worker.  libkrb5 is loaded once per worker process (when
+# profile is imported), and then reused for every bundle that worker handles.
+def audit_bundle(bundle: str, policies: Optional[PolicySet] = None) \
+        -> Tuple[str, List[Finding]]:
+    findings: List[Finding] = []
     try:
-        policies = subprocess.check_output(
-            ["update-crypto-policies", "--show"])[:-1]
-    except FileNotFoundError:
-        return
-
-    for policy in policies.split(b":"):
-        if policy == b"AD-SUPPORT":
-            print("RC4 (weak) permitted by crypto-policies!")
-        elif policy == b"LEGACY":
-            print("Legacy (insecure) algorithms permitted by crypto-policies!")
-
-tgtre = re.compile(r"krbtgt/(.*)")
-def check_princs(permitted_enctypes: str) -> None:
-    princs = kl("listprincs")
-    for princ in princs:
-        short, myrealm = princ.rsplit("@", 1)
-
-        kslist = get_princdata(princ)
-        if short == "K/M":
-            ensure_hasgood(kslist, "the K/M principal (database master key)")
-            continue
-
-        m = tgtre.match(short)
-        if not m:
-            ensure_hasgood(kslist, f"the {short} principal")
-            continue
-
-        destrealm = m.group(1)
-        if destrealm != myrealm:
-            ensure_hasgood(kslist, f"cross-realm principal for {destrealm}")
-            continue
-
-        ensure_hasgood(kslist,
-                       "the krbtgt principal (ticket granting service key)")
-
-def check_kdc() -> None:
+        prof = KRB5Profile(paths=bundle.split(":"))
+        findings.extend(audit_client(prof, policies))
+    except KRB5Error as e:
+        findings.append(Finding("error", "Couldn't load configuration: "
+                                f"error {e.args[0]}", bundle))
+    except AuditError as e:
+        findings.append(Finding("error", str(e), bundle))
+    except Exception as e:
+        # One unreadable bundle (e.g. non-UTF-8 values) mustn't end the run.
+        findings.append(Finding("error", "Couldn't audit configuration: "
+                                f"{e!r}", bundle))
+
+    return bundle, findings
+
+def audit_bundles(bundles: Iterable[str], jobs: Optional[int] = None,
+                  policies: Optional[PolicySet] = None) \
+        -> Iterator[Tuple[str, List[Finding]]]:
+    audit = functools.partial(audit_bundle, policies=policies)
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap(audit, bundles, chunksize=16)
+
+def check_bundles(bundles: List[str], jobs: Optional[int] = None,
+                  policies: Optional[PolicySet] = None) -> None:
+    for bundle, findings in audit_bundles(bundles, jobs, policies):
+        print(f"== {bundle} ==")
+        render(findings)
+
+# princs overrides where principals are read from; see kdb.py.  Those sources
+# don't need the KDC, so they're checked even when the KDC configuration
+# can't be.
+def check_kdc(princs: Optional[Iterable[Tuple[str, str]]] = None,
+              policies: Optional[PolicySet] = None,
+              all_policies: bool = False) -> None:
     if os.getuid() != 0:
         print("\nNot running as root; skipping KDC checks!")
-        return
+    else:
+        render(audit_kdc(KRB5Profile(kdc=True), policies),
+               fatal=princs is None)
 
-    prof = KRB5Profile(kdc=True)
-
-    permitted_enctypes = prof.get_string("libdefaults", "permitted_enctypes",
-                                         default=defetypes)
-    check_etlist(permitted_enctypes, "KDC permitted_enctypes")
-
-    otp = prof.section("otp")
-    for toktype, stanza in otp:
-        server = [v for k, v in stanza if k == "server"]
-        if len(server) > 0 and server[0][0] != '/':
-            print(f"OTP type {toktype} configures RADIUS")
-
-    # Two pkinit_dh_min_bits places on the KDC.
-    dh_min_values = set()
-    dh_4 = prof.get_integer("kdcdefaults", "pkinit_dh_min_bits", None, 2048)
-    if dh_4:
-        dh_min_values.add(int(dh_4))
-
-    realms = prof.section("realms")
-    if len(realms) == 0:
-        print("No realms found checking KDC configuration")
-        exit(1)
-
-    for realm, stanza in realms:
-        has_preauth = False
-        for k, v in stanza:
-            if k == "pkinit_dh_min_bits":
-                dh_min_values.add(int(v)) # dh_5
-            elif k == "master_key_type":
-                # defaults to defmkey, so it's okay to not specify
-                check_etlist(v, "master_key_type")
-            elif k == "default_principal_flags":
-                has_preauth = "+preauth" in v
-
-        if not has_preauth:
-            print(f"{realm} doesn't set +preauth in default_principal_flags")
-
-    # Same rationale as in check_client
-    for v in dh_min_values:
-        if v < 2048:
-            print(f"Weak value for pkinit_dh_min_bits: {v}")
-
-    check_princs(permitted_enctypes)
+    if os.getuid() == 0 or princs is not None:
+        render(audit_princs(princs, policies), all_policies=all_policies)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the health of a Kerberos environment")
+    parser.add_argument("--bundle", action="append", dest="bundles",
+                        metavar="PATH[:PATH...]",
+                        help="audit client configuration from these files "
+                        "instead of the local host (may be repeated)")
+    parser.add_argument("--bundle-list", metavar="FILE",
+                        help="read bundles to audit from FILE, one per line")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes for bundle audits "
+                        "(default: one per CPU)")
+    parser.add_argument("--dump", metavar="FILE",
+                        help="read principals from a kdb5_util dump instead "
+                        "of kadmin.local")
+    parser.add_argument("--ldap-uri", metavar="URI",
+                        help="read principals directly from the LDAP KDB "
+                        "(kldap) at URI instead of kadmin.local")
+    parser.add_argument("--ldap-base", metavar="DN",
+                        help="realm container to search, e.g. "
+                        "cn=EXAMPLE.COM,cn=krbcontainer,dc=example,dc=com")
+    parser.add_argument("--ldap-arg", action="append", default=[],
+                        metavar="ARG",
+                        help="extra ldapsearch argument for binding (may be "
+                        "repeated; default: -Y EXTERNAL -Q)")
+    parser.add_argument("--ldap-page-size", type=int, default=1000,
+                        metavar="N", help="LDAP page size (default: 1000)")
+    parser.add_argument("--policies", metavar="FILE",
+                        help="enctype policies to check against (default: "
+                        "policies.json); must define rhel8 and secure")
+    parser.add_argument("--all-policies", action="store_true",
+                        help="also report principals without keys for each "
+                        "other policy (RHEL 9, FIPS, ...)")
+    args = parser.parse_args()
+    if args.ldap_uri and not args.ldap_base:
+        parser.error("--ldap-uri requires --ldap-base")
+
+    policies = None
+    if args.policies:
+        try:
+            policies = load_policies(args.policies)
+        except AuditError as e:
+            parser.error(str(e))
+
+    bundles = args.bundles or []
+    if args.bundle_list:
+        with open(args.bundle_list, "r") as f:
+            bundles += [line.strip() for line in f if line.strip()]
+    if bundles:
+        check_bundles(bundles, args.jobs, policies)
+        exit(0)
+
     ret, out = subprocess.getstatusoutput("rpm -qv krb5-libs")
     if ret != 0:
         print(f"Couldn't detect OS version: {out}")
@@ -195,7 +156,14 @@ if __name__ == "__main__":
         print("krb5 < 1.14 not supported; upgrade and try again")
         exit(1)
     if minver >= 18:
-        check_crypto_policies()
+        render(audit_crypto_policies())
+
+    princs: Optional[Iterable[Tuple[str, str]]] = None
+    if args.dump:
+        princs = dump_princs(args.dump)
+    elif args.ldap_uri:
+        princs = ldap_princs(args.ldap_uri, args.ldap_base, args.ldap_arg,
+                             args.ldap_page_size)
 
-    check_client()
-    check_kdc()
+    check_client(policies)
+    check_kdc(princs, policies, args.all_policies)
@@ -1,8 +1,14 @@
 # A model for enctypes/keysalts from krb5.
 
+import functools
+import json
+import os
 import re
 
-from typing import Set, Union
+from findings import AuditError, Finding
+
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, \
+    Set, Tuple, Union
 
 # "canonical" names are intentionally different from krb5's
 et_mapping = {
@@ -30,25 +36,51 @@ et_mapping = {
 }
 ets = set(et_mapping.keys())
 
-et_no_rhel8 = set(["des/crc32", "des/md4", "des/md5", "des/raw", "des/sha1",
-                   "des3/raw", "des3/sha1"])
-et_broken = et_no_rhel8.union(["rc4/md5", "rc4/export"])
-
 salts = set(["normal", "v4", "norealm", "onlyrealm", "afs3", "special"])
-salt_no_rhel8 = set(["v4", "afs3"])
+
+# Protocol numbers, as stored in the KDB, mapped to krb5's primary names
+et_numbers = {
+    1: "des-cbc-crc",
+    2: "des-cbc-md4",
+    3: "des-cbc-md5",
+    4: "des-cbc-raw",
+    6: "des3-cbc-raw",
+    8: "des-hmac-sha1",
+    16: "des3-cbc-sha1",
+    17: "aes128-cts-hmac-sha1-96",
+    18: "aes256-cts-hmac-sha1-96",
+    19: "aes128-cts-hmac-sha256-128",
+    20: "aes256-cts-hmac-sha384-192",
+    23: "arcfour-hmac",
+    24: "arcfour-hmac-exp",
+    25: "camellia128-cts-cmac",
+    26: "camellia256-cts-cmac",
+}
+salt_numbers = {
+    0: "normal",
+    1: "v4",
+    2: "norealm",
+    3: "onlyrealm",
+    4: "special",
+    5: "afs3",
+}
 
 splitre = re.compile(r"[, ]+")
 
+class EnctypeError(AuditError):
+    pass
+
 def strip_deprecated(raw: str) -> str:
     # Thanks, past me
     if raw.startswith("UNSUPPORTED:"):
-        print(f"Unsupported enctype/keysalt: {raw}")
-        exit(1)
+        raise EnctypeError(f"Unsupported enctype/keysalt: {raw}")
     elif raw.startswith("DEPRECATED:"):
         raw = raw.split(":", 1)[-1]
     return raw
 
-def canonicalize_et(raw: str) -> Set[str]:
+# The tables never change, so lookups are cached across calls (and audits).
+@functools.lru_cache(maxsize=None)
+def canonicalize_et(raw: str) -> FrozenSet[str]:
     raw = strip_deprecated(raw)
     ret = set()
     found = False
@@ -57,67 +89,182 @@ def canonicalize_et(raw: str) -> Set[str]:
             found = True
             ret.add(k)
     if not found:
-        print(f"enctype {raw} is not recognized by krb5!")
-        exit(1)
+        raise EnctypeError(f"enctype {raw} is not recognized by krb5!")
 
-    return ret
+    return frozenset(ret)
 
 def canonicalize_etlist(raw: str) -> Set[str]:
-    ret = set()
+    ret: Set[str] = set()
     for et in splitre.split(raw):
         ret.update(canonicalize_et(et))
     return ret
 
-def warn_if_in(etlist: Set[str], bad: Set[str], error: str) -> None:
+# Splits "enctype[:salt]" into its parts.
+def split_keysalt(ks: str) -> Tuple[str, str]:
+    et = ks
+    salt = "normal"
+
+    sp = ks.split(":", 1)
+    if len(sp) > 1:
+        et = sp[0]
+        if len(sp[1]) > 1:
+            salt = sp[1]
+
+    return et, salt
+
+def all_in(smaller: FrozenSet[str], larger: FrozenSet[str]) -> bool:
+    i = smaller.intersection(larger)
+    return len(i) == len(smaller)
+
+# Policies are data: see policies.json.  Each names the enctypes (canonical
+# names, or krb5 names and aliases) and salt types it disallows.
+class Policy(NamedTuple):
+    name: str
+    description: str
+    enctypes: FrozenSet[str]
+    salts: FrozenSet[str]
+
+    # This is ugly because we've prepared for partial deprecation of
+    # aliases - for exapmle, this allows us to deprecate aes128/sha1 while
+    # keeping aes256/sha1, and behaving properly when someone sets "aes".
+    def permits(self, ets: FrozenSet[str], salt: str) -> bool:
+        return salt not in self.salts and not all_in(ets, self.enctypes)
+
+# All policies, compiled together so that a keysalt list is classified
+# against every one of them in a single pass.  Each distinct keysalt maps to a
+# bitmask with bit i set if policy i permits it; a list's verdict is the OR
+# of its keysalts' masks.
+class PolicySet:
+    def __init__(self, policies: Iterable[Policy]) -> None:
+        self.policies = list(policies)
+        self.index = {p.name: i for i, p in enumerate(self.policies)}
+        self.masks: Dict[str, int] = {}
+
+    def __getitem__(self, name: str) -> Policy:
+        return self.policies[self.index[name]]
+
+    def keysalt_mask(self, ks: str) -> int:
+        mask = self.masks.get(ks)
+        if mask is not None:
+            return mask
+
+        et, salt = split_keysalt(strip_deprecated(ks))
+        canon = canonicalize_et(et)
+        mask = 0
+        for i, policy in enumerate(self.policies):
+            if policy.permits(canon, salt):
+                mask |= 1 << i
+
+        # Only cached on success, so bad input keeps raising.
+        self.masks[ks] = mask
+        return mask
+
+    # Returns a bitmask: bit i is set if policy i permits some keysalt in raw.
+    def evaluate_mask(self, raw: str) -> int:
+        mask = 0
+        kslist = splitre.split(raw)
+        assert(len(kslist) > 0)
+        for ks in kslist:
+            mask |= self.keysalt_mask(ks)
+        return mask
+
+    # Returns, per policy (in order), whether any keysalt in raw is usable.
+    def evaluate(self, raw: Union[str, bytes]) -> Tuple[bool, ...]:
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+
+        mask = self.evaluate_mask(raw)
+        return tuple(bool(mask & (1 << i))
+                     for i in range(len(self.policies)))
+
+REQUIRED_POLICIES = ["rhel8", "secure"]
+
+def load_policies(path: str) -> PolicySet:
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise AuditError(f"Couldn't load policies from {path}: {e}")
+
+    policies = []
+    for p in data:
+        if not isinstance(p, dict) or "name" not in p:
+            raise AuditError(f"Policy without a name in {path}")
+
+        disallowed: Set[str] = set()
+        for et in p.get("disallowed_enctypes", []):
+            disallowed.update([et] if et in ets else canonicalize_et(et))
+
+        bad_salts = set(p.get("disallowed_salts", []))
+        for salt in bad_salts - salts:
+            raise EnctypeError(f"salt type {salt} is not recognized by krb5!")
+
+        policies.append(Policy(p["name"], p.get("description") or p["name"],
+                               frozenset(disallowed), frozenset(bad_salts)))
+
+    # The long-standing checks are expressed in terms of these two.
+    names = {p.name for p in policies}
+    for required in REQUIRED_POLICIES:
+        if required not in names:
+            raise AuditError(f"Policy {required} missing from {path}")
+
+    return PolicySet(policies)
+
+default_policies = load_policies(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 "policies.json"))
+
+et_no_rhel8 = default_policies["rhel8"].enctypes
+et_broken = default_policies["secure"].enctypes
+salt_no_rhel8 = default_policies["rhel8"].salts
+
+def warn_if_in(etlist: Set[str], bad: FrozenSet[str], kind: str, error: str,
+               name: str) -> List[Finding]:
     in_bad = etlist.intersection(bad)
     if len(in_bad) > 0:
-        print(f"{error}: {sorted(in_bad)}")
+        return [Finding(kind, f"{error}: {sorted(in_bad)}", name)]
+    return []
 
-def check_etlist(raw: Union[str, bytes], name: str) -> None:
+# policies defaults to default_policies (policies.json) here and below.
+def check_etlist(raw: Union[str, bytes], name: str,
+                 policies: Optional[PolicySet] = None) -> List[Finding]:
     if isinstance(raw, bytes):
         raw = raw.decode("utf-8")
+    if policies is None:
+        policies = default_policies
 
     etlist = canonicalize_etlist(raw)
-    warn_if_in(etlist, et_no_rhel8,
-               f"Unsupported in RHEL 8 enctype(s) specified in {name}")
-    warn_if_in(etlist, et_broken, f"Insecure enctype(s) specified in {name}")
+    return warn_if_in(etlist, policies["rhel8"].enctypes, "no-rhel8-enctypes",
+                      f"Unsupported in RHEL 8 enctype(s) specified in {name}",
+                      name) + \
+        warn_if_in(etlist, policies["secure"].enctypes, "insecure-enctypes",
+                   f"Insecure enctype(s) specified in {name}", name)
 
-def all_in(smaller: Set[str], larger: Set[str]) -> bool:
-    i = smaller.intersection(larger)
-    return len(i) == len(smaller)
+def ensure_hasgood(raw: Union[str, bytes], name: str,
+                   policies: Optional[PolicySet] = None) -> List[Finding]:
+    if policies is None:
+        policies = default_policies
+    verdict = policies.evaluate(raw)
 
-def ensure_hasgood(raw: Union[str, bytes], name: str) -> None:
-    if isinstance(raw, bytes):
-        raw = raw.decode("utf-8")
+    ret = []
+    for policy, ok in zip(policies.policies, verdict):
+        if ok:
+            continue
+
+        if policy.name == "rhel8":
+            ret.append(Finding("no-rhel8-keys",
+                               f"No RHEL 8 supported enctypes for {name}",
+                               name, policy="rhel8"))
+        elif policy.name == "secure":
+            ret.append(Finding("no-secure-keys",
+                               f"No secure enctypes for {name}", name,
+                               policy="secure"))
+        else:
+            ret.append(Finding("no-policy-keys",
+                               f"No enctypes permitted by policy "
+                               f"{policy.name} ({policy.description}) for "
+                               f"{name}", name, policy=policy.name))
 
-    norhel8 = 0
-    broken = 0
-
-    kslist = splitre.split(raw)
-    assert(len(kslist) > 0)
-    for ks in kslist:
-        ks = strip_deprecated(ks)
-
-        et = ks
-        salt = "normal"
-
-        sp = ks.split(":", 1)
-        if len(sp) > 1:
-            et = sp[0]
-            if len(sp[1]) > 1:
-                salt = sp[1]
-
-        ets = canonicalize_et(et)
-
-        # This is ugly because we've prepared for partial deprecation of
-        # aliases - for exapmle, this allows us to deprecate aes128/sha1 while
-        # keeping aes256/sha1, and behaving properly when someone sets "aes".
-        if salt in salt_no_rhel8 or all_in(ets, et_no_rhel8):
-            norhel8 += 1
-        if all_in(ets, et_broken):
-            broken += 1
-
-    if norhel8 == len(kslist):
-        print(f"No RHEL 8 supported enctypes for {name}")
-    if broken == len(kslist):
-        print(f"No secure enctypes for {name}")
+    # Keep the long-standing order: RHEL 8, then secure, then the rest.
+    order = {"no-rhel8-keys": 0, "no-secure-keys": 1}
+    return sorted(ret, key=lambda f: order.get(f.kind, 2))
@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+
+# Serves realm crypto health as Prometheus-style metrics.
+#
+# A background thread re-runs the audits every --interval seconds and renders
+# the metrics page once; scrapes are answered from that cached page, so they
+# take constant time and never trigger a principal scan themselves.
+
+import argparse
+import http.server
+import os
+import socketserver
+import threading
+import time
+
+from collections import defaultdict
+
+from audit import CATEGORIES, audit_client, audit_kdc, audit_princs
+from enctypes import PolicySet, default_policies, load_policies
+from findings import AuditError, Finding
+from kdb import dump_princs, kadmin_princs
+from profile import KRB5Profile
+
+from typing import DefaultDict, Dict, Iterable, Iterator, List, Optional, \
+    Set, Tuple
+
+# name -> (help, labels)
+METRICS = {
+    "krb5check_principals_no_secure_keys":
+    ("Principals with no secure enctypes", ["realm", "category"]),
+    "krb5check_principals_no_rhel8_keys":
+    ("Principals with no RHEL 8 supported enctypes", ["realm", "category"]),
+    "krb5check_principals_no_policy_keys":
+    ("Principals with no enctypes permitted by a policy",
+     ["realm", "category", "policy"]),
+    "krb5check_principals_unreadable":
+    ("Principals whose keys could not be checked", ["realm", "category"]),
+    "krb5check_permitted_enctypes_broken":
+    ("Whether permitted_enctypes contains broken enctypes", ["config"]),
+    "krb5check_permitted_enctypes_no_rhel8":
+    ("Whether permitted_enctypes contains enctypes RHEL 8 doesn't support",
+     ["config"]),
+    "krb5check_pkinit_dh_min_bits_weak":
+    ("Weak pkinit_dh_min_bits values configured", ["config"]),
+    "krb5check_realm_no_preauth":
+    ("Whether the realm doesn't set +preauth in default_principal_flags",
+     ["realm"]),
+    "krb5check_audit_success":
+    ("Whether the last audit completed", []),
+    "krb5check_audit_step_success":
+    ("Whether each part of the last audit completed; series for a part "
+     "that failed are omitted", ["step"]),
+    "krb5check_audit_timestamp_seconds":
+    ("When the last audit finished", []),
+    "krb5check_audit_duration_seconds":
+    ("How long the last audit took", []),
+}
+
+Samples = DefaultDict[str, Dict[Tuple[str, ...], float]]
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"') \
+                .replace("\n", "\\n")
+
+def render(samples: Samples) -> bytes:
+    out = []
+    for name, (doc, labels) in METRICS.items():
+        out.append(f"# HELP {name} {doc}")
+        out.append(f"# TYPE {name} gauge")
+        for values, v in sorted(samples[name].items()):
+            pairs = ",".join(f'{l}="{escape(x)}"'
+                             for l, x in zip(labels, values))
+            out.append(f"{name}{{{pairs}}} {v}" if pairs
+                       else f"{name} {v}")
+    return ("\n".join(out) + "\n").encode("utf-8")
+
+# realms are those configured, so that healthy ones still get a series.
+def config_findings(samples: Samples, config: str,
+                    findings: Iterable[Finding],
+                    realms: Iterable[str] = ()) -> None:
+    for realm in realms:
+        samples["krb5check_realm_no_preauth"][(realm,)] = 0
+    samples["krb5check_permitted_enctypes_broken"][(config,)] = 0
+    samples["krb5check_permitted_enctypes_no_rhel8"][(config,)] = 0
+    samples["krb5check_pkinit_dh_min_bits_weak"][(config,)] = 0
+
+    for f in findings:
+        permitted = f.subject.endswith("permitted_enctypes")
+        if f.kind == "insecure-enctypes" and permitted:
+            samples["krb5check_permitted_enctypes_broken"][(config,)] = 1
+        elif f.kind == "no-rhel8-enctypes" and permitted:
+            samples["krb5check_permitted_enctypes_no_rhel8"][(config,)] = 1
+        elif f.kind == "weak-dh":
+            samples["krb5check_pkinit_dh_min_bits_weak"][(config,)] += 1
+        elif f.kind == "no-preauth":
+            samples["krb5check_realm_no_preauth"][(f.realm,)] = 1
+
+PRINC_METRICS = {
+    "no-secure-keys": "krb5check_principals_no_secure_keys",
+    "no-rhel8-keys": "krb5check_principals_no_rhel8_keys",
+    "error": "krb5check_principals_unreadable",
+}
+
+# realms are those principals were seen in, healthy or not.  Every policy
+# (RHEL 8 and secure included) also gets its own series of the policy gauge.
+def princ_findings(samples: Samples, findings: Iterable[Finding],
+                   realms: Iterable[str], policies: PolicySet) -> None:
+    per_policy = samples["krb5check_principals_no_policy_keys"]
+    for realm in realms:
+        for category in CATEGORIES:
+            for name in PRINC_METRICS.values():
+                samples[name][(realm, category)] = 0
+            for policy in policies.policies:
+                per_policy[(realm, category, policy.name)] = 0
+
+    for f in findings:
+        if f.kind in PRINC_METRICS:
+            samples[PRINC_METRICS[f.kind]][(f.realm, f.category)] += 1
+        if f.policy:
+            per_policy[(f.realm, f.category, f.policy)] += 1
+
+def note_realms(princs: Iterable[Tuple[str, str]],
+                realms: Set[str]) -> Iterator[Tuple[str, str]]:
+    for princ, kslist in princs:
+        realms.add(princ.rsplit("@", 1)[-1])
+        yield princ, kslist
+
+def kdc_realms(prof: KRB5Profile) -> List[str]:
+    return [realm for realm, _ in prof.section("realms")]
+
+class Refresher(threading.Thread):
+    def __init__(self, interval: float, paths: Optional[List[str]],
+                 kdc: bool, dump: Optional[str],
+                 policies: PolicySet = default_policies) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.paths = paths
+        self.kdc = kdc
+        self.dump = dump
+        self.policies = policies
+        self.page = render(defaultdict(dict))
+
+        # Principal results are kept between refreshes when their source
+        # hasn't changed (a dump with the same mtime and size).
+        self.princ_key: Optional[Tuple[float, int]] = None
+        self.princ_findings: List[Finding] = []
+        self.princ_realms: Set[str] = set()
+
+    # Returns (findings, realms seen).
+    def audit_princs(self) -> Tuple[List[Finding], Set[str]]:
+        realms: Set[str] = set()
+        if self.dump is None:
+            return list(audit_princs(note_realms(kadmin_princs(), realms),
+                                     self.policies)), realms
+
+        st = os.stat(self.dump)
+        key = (st.st_mtime, st.st_size)
+        if key != self.princ_key:
+            self.princ_findings = list(audit_princs(
+                note_realms(dump_princs(self.dump), realms), self.policies))
+            self.princ_realms = realms
+            self.princ_key = key
+        return self.princ_findings, self.princ_realms
+
+    def audit_client(self, samples: Samples) -> None:
+        prof = KRB5Profile(paths=self.paths)
+        config_findings(samples, "client", audit_client(prof, self.policies))
+
+    def audit_kdc(self, samples: Samples) -> None:
+        prof = KRB5Profile(kdc=True)
+        config_findings(samples, "kdc", audit_kdc(prof, self.policies),
+                        kdc_realms(prof))
+
+    def audit_all_princs(self, samples: Samples) -> None:
+        findings, realms = self.audit_princs()
+        princ_findings(samples, findings, realms, self.policies)
+
+    def refresh(self) -> None:
+        samples: Samples = defaultdict(dict)
+        start = time.time()
+
+        # Each part is independent; one failing shouldn't blank the others.
+        steps = [("client", self.audit_client)]
+        if self.kdc:
+            steps.append(("kdc", self.audit_kdc))
+        if self.kdc or self.dump is not None:
+            steps.append(("principals", self.audit_all_princs))
+
+        success = 1
+        for name, step in steps:
+            # A step's series are only published if it finishes, so that a
+            # partial audit doesn't export gauges it never reached as 0.
+            # Anything at all going wrong here is a failed audit, not a
+            # reason to stop refreshing.
+            step_samples: Samples = defaultdict(dict)
+            try:
+                step(step_samples)
+            except Exception as e:
+                print(f"Audit of {name} failed: {e!r}")
+                samples["krb5check_audit_step_success"][(name,)] = 0
+                success = 0
+                continue
+
+            samples["krb5check_audit_step_success"][(name,)] = 1
+            for metric, values in step_samples.items():
+                samples[metric].update(values)
+
+        end = time.time()
+        samples["krb5check_audit_success"][()] = success
+        samples["krb5check_audit_timestamp_seconds"][()] = end
+        samples["krb5check_audit_duration_seconds"][()] = end - start
+
+        # Assignment is atomic; scrapes see either the old page or this one.
+        self.page = render(samples)
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Refresh failed: {e!r}")
+            time.sleep(self.interval)
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+def make_handler(refresher: Refresher) -> type:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            page = refresher.page
+            self.send_response(200)
+            self.send_header("Content-Type",
+                             "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+    return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve Kerberos crypto health as Prometheus metrics")
+    parser.add_argument("--listen", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=9799,
+                        help="port to listen on (default: 9799)")
+    parser.add_argument("--interval", type=float, default=300,
+                        help="seconds between audits (default: 300)")
+    parser.add_argument("--config", metavar="PATH[:PATH...]",
+                        help="client configuration to audit instead of the "
+                        "local host's")
+    parser.add_argument("--dump", metavar="FILE",
+                        help="read principals from a kdb5_util dump instead "
+                        "of kadmin.local")
+    parser.add_argument("--policies", metavar="FILE",
+                        help="enctype policies to report on (default: "
+                        "policies.json); must define rhel8 and secure")
+    args = parser.parse_args()
+
+    policies = default_policies
+    if args.policies:
+        try:
+            policies = load_policies(args.policies)
+        except AuditError as e:
+            parser.error(str(e))
+
+    # As with check.py, KDC checks need root.
+    kdc = os.getuid() == 0
+    paths = args.config.split(":") if args.config else None
+
+    refresher = Refresher(args.interval, paths, kdc, args.dump, policies)
+    refresher.start()
+
+    server = ThreadingHTTPServer((args.listen, args.port),
+                                 make_handler(refresher))
+    server.serve_forever()
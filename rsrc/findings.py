@@ -0,0 +1,35 @@
+# Results of the checks, for callers to render (or count) however they like.
+
+from typing import NamedTuple
+
+# kind is one of:
+#
+#   weak-crypto-allowed   allow_weak_crypto is turned on
+#   no-rhel8-enctypes     config lists enctypes RHEL 8 doesn't support
+#   insecure-enctypes     config lists broken enctypes
+#   v4-config             Kerberos v4 configuration is present
+#   weak-dh               pkinit_dh_min_bits is too small
+#   radius                OTP is configured to use RADIUS
+#   no-preauth            a realm doesn't require preauth by default
+#   weak-crypto-policy    crypto-policies permits weak algorithms
+#   no-rhel8-keys         a principal has no RHEL 8 supported keys
+#   no-secure-keys        a principal has no secure keys
+#   no-policy-keys        a principal has no keys some other policy (named by
+#                         policy; see policies.json) permits
+#   error                 a check couldn't be completed for subject
+#
+# message is the human-readable form, as check.py prints it.  subject is the
+# setting or principal the finding is about; realm, category (see
+# audit.princ_category()), and policy are filled in where known.
+class Finding(NamedTuple):
+    kind: str
+    message: str
+    subject: str = ""
+    realm: str = ""
+    category: str = ""
+    policy: str = ""
+
+# Raised when a check can't be performed at all.  Nothing is left in a bad
+# state, so it's safe to catch this and carry on (or try again).
+class AuditError(Exception):
+    pass
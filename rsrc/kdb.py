@@ -0,0 +1,335 @@
+# Sources of principal key data: kadmin (usually kadmin.local), a kdb5_util
+# dump, or the LDAP directory behind the kldap KDB module.
+
+import base64
+import re
+import subprocess
+
+from enctypes import EnctypeError, et_numbers, salt_numbers
+from findings import AuditError
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, \
+    Tuple, Union
+
+# (name, highest kvno, [(enctype, salttype), ...])
+DumpRecord = Tuple[str, int, List[Tuple[int, int]]]
+
+# Used to skip principals by name before doing any expensive work on them.
+NameFilter = Optional[Callable[[str], bool]]
+
+# kadmin is the command to run, with any arguments it needs (e.g. "kadmin -s
+# kdc2.example.com -k").
+def kl(cmd: str, kadmin: str = "kadmin.local") -> List[str]:
+    res = subprocess.check_output(f"{kadmin} -q '{cmd}'", shell=True)
+    decoded = res.decode('utf-8')
+    return decoded.strip().split("\n")[1:]
+
+key_re = re.compile(r"^Key: vno (\d+), (.*)$")
+def get_keys(princ: str, kadmin: str = "kadmin.local") \
+        -> List[Tuple[int, str]]:
+    keys = []
+    for line in kl(f"getprinc {princ}", kadmin):
+        m = key_re.match(line)
+        if m:
+            keys.append((int(m.group(1)), m.group(2)))
+
+    return keys
+
+# kadmin names types it doesn't know as e.g. "<Salt type 0x6>".
+unknown_re = re.compile(r"<(?:Encryption|Salt) type (0x[0-9a-fA-F]+)>")
+
+def get_princdata(princ: str, kadmin: str = "kadmin.local") -> str:
+    # Keep the list space-separated; the bare number will be reported as
+    # unrecognized.
+    return " ".join(unknown_re.sub(r"\1", ks)
+                    for _, ks in get_keys(princ, kadmin))
+
+et_by_name = {v: k for k, v in et_numbers.items()}
+salt_by_name = {v: k for k, v in salt_numbers.items()}
+
+def kadmin_number(name: str, table: Dict[str, int], what: str) -> int:
+    m = unknown_re.fullmatch(name)
+    if m:
+        return int(m.group(1), 16)
+    if name not in table:
+        raise EnctypeError(f"{what} {name} is not recognized by krb5!")
+    return table[name]
+
+# Converts kadmin's rendering of a key to protocol numbers, as in a dump.
+# Newer kadmin marks old enctypes DEPRECATED: or UNSUPPORTED:, and leaves off
+# the salt when it's the normal one.
+def kadmin_keysalt(ks: str) -> Tuple[int, int]:
+    for prefix in ["DEPRECATED:", "UNSUPPORTED:"]:
+        if ks.startswith(prefix):
+            ks = ks[len(prefix):]
+
+    et, _, salt = ks.partition(":")
+    return kadmin_number(et, et_by_name, "enctype"), \
+        kadmin_number(salt or "normal", salt_by_name, "salt type")
+
+def kadmin_records(kadmin: str = "kadmin.local",
+                   keep: NameFilter = None) -> Iterator[DumpRecord]:
+    for princ in kl("listprincs", kadmin):
+        if keep is not None and not keep(princ):
+            continue
+
+        keys = get_keys(princ, kadmin)
+        kvno = max((vno for vno, _ in keys), default=0)
+        yield princ, kvno, [kadmin_keysalt(ks) for _, ks in keys]
+
+# Yields (principal, keysalt list) pairs, in the same form kadmin reports.
+def kadmin_princs() -> Iterator[Tuple[str, str]]:
+    for princ in kl("listprincs"):
+        yield princ, get_princdata(princ)
+
+def et_name(num: int) -> str:
+    # Unknown numbers are passed through; canonicalize_et() will complain.
+    return et_numbers.get(num, str(num))
+
+# A princ record in a (version 7 or later) dump is tab-separated:
+#
+#   princ 38 <name len> <n_tl_data> <n_key_data> <e_len> <name> <attributes>
+#   <max_life> <max_renew> <expiration> <pw_expiration> <last_success>
+#   <last_failed> <fail_count> [<type> <len> <contents>]...
+#   [<ver> <kvno> <enctype> <len> <contents> [<salttype> <len> <contents>]]...
+#   <e_data>;
+#
+# Only the key data is of interest here; contents are never decoded.
+def parse_dump_princ(fields: List[str]) -> DumpRecord:
+    n_tl, n_key = int(fields[3]), int(fields[4])
+    name = fields[6]
+
+    i = 15 + 3 * n_tl
+    kvno = 0
+    keys = []
+    for _ in range(n_key):
+        ver, kvno_k = int(fields[i]), int(fields[i + 1])
+        kvno = max(kvno, kvno_k)
+        enctype = int(fields[i + 2])
+        salttype = 0
+        if ver > 1:
+            salttype = int(fields[i + 5])
+        keys.append((enctype, salttype))
+        i += 2 + 3 * ver
+
+    return name, kvno, keys
+
+def dump_records(path: str, keep: NameFilter = None) -> Iterator[DumpRecord]:
+    with open(path, "r") as f:
+        for line in f:
+            if not line.startswith("princ\t"):
+                continue
+
+            fields = line.rstrip("\n").split("\t")
+            if keep is not None and not keep(fields[6]):
+                continue
+            yield parse_dump_princ(fields)
+
+keysalt_names: Dict[Tuple[int, int], str] = {}
+def keysalt_list(keys: List[Tuple[int, int]]) -> List[str]:
+    ret = []
+    for key in keys:
+        # Only a handful of distinct pairs exist, so they're cached.
+        name = keysalt_names.get(key)
+        if name is None:
+            et, salt = key
+            name = f"{et_name(et)}:{salt_numbers.get(salt, str(salt))}"
+            keysalt_names[key] = name
+        ret.append(name)
+    return ret
+
+def keysalts(keys: List[Tuple[int, int]]) -> str:
+    return " ".join(keysalt_list(keys))
+
+def dump_princs(path: str) -> Iterator[Tuple[str, str]]:
+    for name, _, keys in dump_records(path):
+        yield name, keysalts(keys)
+
+# kldap stores each kvno's keys as one krbPrincipalKey value, a DER-encoded
+# KrbKeySet (see krb5's kldap.schema and ldap_principal2.c):
+#
+#   KrbKeySet ::= SEQUENCE {
+#       attribute-major-vno [0] UInt16,
+#       attribute-minor-vno [1] UInt16,
+#       kvno                [2] UInt32,
+#       mkvno               [3] UInt32 OPTIONAL,
+#       keys                [4] SEQUENCE OF KrbKey }
+#   KrbKey ::= SEQUENCE {
+#       salt      [0] KrbSalt OPTIONAL,
+#       key       [1] EncryptionKey,
+#       s2kparams [2] OCTET STRING OPTIONAL }
+#   KrbSalt ::= SEQUENCE { type [0] Int32, salt [1] OCTET STRING OPTIONAL }
+#   EncryptionKey ::= SEQUENCE { keytype [0] Int32, keyvalue [1] OCTET STRING }
+#
+# Only kvno, enctype, and salt type are extracted; key values are skipped.
+class DERError(AuditError):
+    pass
+
+# Reads the element at data[i]; returns (tag, content start, content end).
+def der_next(data: bytes, i: int, end: int) -> Tuple[int, int, int]:
+    if i + 2 > end:
+        raise DERError("truncated element")
+    tag, length = data[i], data[i + 1]
+    i += 2
+    if length & 0x80:
+        n = length & 0x7f
+        length = int.from_bytes(data[i:i + n], "big")
+        i += n
+    if i + length > end:
+        raise DERError("truncated element")
+    return tag, i, i + length
+
+def der_children(data: bytes, start: int, end: int) \
+        -> Iterator[Tuple[int, int, int]]:
+    i = start
+    while i < end:
+        tag, s, e = der_next(data, i, end)
+        yield tag, s, e
+        i = e
+
+# Contents of an explicitly tagged [n] field in a SEQUENCE, or None.
+def der_field(data: bytes, start: int, end: int, n: int) \
+        -> Optional[Tuple[int, int]]:
+    for tag, s, e in der_children(data, start, end):
+        if tag == 0xa0 + n:
+            return s, e
+    return None
+
+def der_int(data: bytes, start: int, end: int, n: int) -> Optional[int]:
+    field = der_field(data, start, end, n)
+    if field is None:
+        return None
+    tag, s, e = der_next(data, field[0], field[1])
+    if tag != 0x02:
+        raise DERError("expected INTEGER")
+    return int.from_bytes(data[s:e], "big", signed=True)
+
+def der_seq(data: bytes, start: int, end: int) -> Tuple[int, int]:
+    tag, s, e = der_next(data, start, end)
+    if tag != 0x30:
+        raise DERError("expected SEQUENCE")
+    return s, e
+
+def decode_keyset(data: bytes) -> Tuple[int, List[Tuple[int, int]]]:
+    start, end = der_seq(data, 0, len(data))
+    kvno = der_int(data, start, end, 2)
+    keys_field = der_field(data, start, end, 4)
+    if kvno is None or keys_field is None:
+        raise DERError("missing kvno or keys")
+
+    keys = []
+    ks, ke = der_seq(data, *keys_field)
+    for tag, s, e in der_children(data, ks, ke):
+        if tag != 0x30:
+            raise DERError("expected SEQUENCE")
+
+        # An absent salt is the normal one.
+        salttype = 0
+        salt = der_field(data, s, e, 0)
+        if salt is not None:
+            salttype = der_int(data, *der_seq(data, *salt), 0) or 0
+
+        key = der_field(data, s, e, 1)
+        if key is None:
+            raise DERError("missing key")
+        enctype = der_int(data, *der_seq(data, *key), 0)
+        if enctype is None:
+            raise DERError("missing keytype")
+
+        keys.append((enctype, salttype))
+
+    return kvno, keys
+
+# Yields entries from (unwrapped or wrapped) LDIF as {attribute: [values]},
+# with base64 values decoded to bytes and everything else left as str.
+def ldif_entries(lines: Iterator[str]) \
+        -> Iterator[Dict[str, List[Union[str, bytes]]]]:
+    entry: Dict[str, List[Union[str, bytes]]] = {}
+    pending = None
+
+    def finish(line: Optional[str]) -> None:
+        if line is None or line.startswith("#"):
+            return
+        attr, value = line.split(":", 1)
+        decoded: Union[str, bytes] = value.lstrip(" ")
+        if value.startswith(":"):
+            decoded = base64.b64decode(value[1:].strip())
+        entry.setdefault(attr.lower(), []).append(decoded)
+
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith(" ") and pending is not None:
+            pending += line[1:]
+            continue
+
+        finish(pending)
+        pending = None
+        if line == "":
+            if entry:
+                yield entry
+            entry = {}
+            continue
+        pending = line
+
+    finish(pending)
+    if entry:
+        yield entry
+
+def text(value: Union[str, bytes]) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+# Stands in for a keysalt list that couldn't be read; it carries the reason.
+# Consumers should report the principal as an error rather than audit it.
+class BadKeys(str):
+    pass
+
+# Reads principals straight out of the directory with one paged search over
+# the realm container (base), rather than a round-trip per principal through
+# kadmin.  args are extra ldapsearch arguments, for binding; by default,
+# SASL EXTERNAL is used (as for ldapi:// as root).  Yields (principal,
+# [encoded krbPrincipalKey values]).
+def ldap_entries(uri: str, base: str, args: Sequence[str] = (),
+                 page_size: int = 1000) -> Iterator[Tuple[str, List[bytes]]]:
+    cmd = ["ldapsearch", "-LLL", "-o", "ldif-wrap=no",
+           "-E", f"pr={page_size}/noprompt", "-H", uri, "-b", base]
+    cmd += args if args else ["-Y", "EXTERNAL", "-Q"]
+    cmd += ["(krbPrincipalName=*)", "krbPrincipalName", "krbCanonicalName",
+            "krbPrincipalKey"]
+
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                universal_newlines=True)
+    except OSError as e:
+        raise AuditError(f"Couldn't run ldapsearch: {e}")
+    assert proc.stdout is not None
+    try:
+        for entry in ldif_entries(proc.stdout):
+            names = entry.get("krbcanonicalname") or \
+                entry.get("krbprincipalname") or []
+            if len(names) == 0:
+                continue
+
+            values = [v.encode("utf-8") if isinstance(v, str) else v
+                      for v in entry.get("krbprincipalkey", [])]
+            yield text(names[0]), values
+    finally:
+        proc.stdout.close()
+        ret = proc.wait()
+    if ret != 0:
+        raise AuditError(f"ldapsearch failed (exit status {ret}) reading "
+                         f"principals from {uri}")
+
+# A principal whose keys can't be decoded is yielded with BadKeys, so one bad
+# entry doesn't stop the scan.
+def ldap_princs(uri: str, base: str, args: Sequence[str] = (),
+                page_size: int = 1000) -> Iterator[Tuple[str, str]]:
+    for name, values in ldap_entries(uri, base, args, page_size):
+        keys: List[Tuple[int, int]] = []
+        try:
+            for value in values:
+                keys += decode_keyset(value)[1]
+        except DERError as e:
+            yield name, BadKeys(f"Bad krbPrincipalKey: {e}")
+            continue
+
+        yield name, keysalts(keys)
@@ -75,6 +75,11 @@ krb5_get_profile.argtypes = (krb5_context, ctypes.POINTER(profile_t))
 krb5_get_profile.restype = krb5_error
 krb5_get_profile.errcheck = krb5_errcheck
 
+profile_init_path = LIBKRB5.profile_init_path
+profile_init_path.argtypes = (c_text_p, ctypes.POINTER(profile_t))
+profile_init_path.restype = krb5_error
+profile_init_path.errcheck = krb5_errcheck
+
 profile_release = LIBKRB5.profile_release
 profile_release.argtypes = (profile_t, )
 profile_release.restype = None
@@ -169,8 +174,18 @@ class KRB5Profile:
         if not PY3:
             next = __next__
 
-    def __init__(self, kdc=False):
+    # paths is a list of files in the same form as KRB5_CONFIG; if given, the
+    # default profile (and environment) is not consulted at all.
+    def __init__(self, kdc=False, paths=None):
         self.__context = self.__profile = None
+        if paths is not None:
+            if isinstance(paths, str):
+                paths = [paths]
+            profile = profile_t()
+            profile_init_path(":".join(paths), ctypes.byref(profile))
+            self.__profile = profile
+            return
+
         context = krb5_context()
         krb5_init_context_profile(None, 2 if kdc else 0,
                                   ctypes.byref(context))
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+# Compares principal key metadata (kvno and enctype/salt list, never key
+# contents) between two KDBs - typically a primary and a replica after kprop
+# trouble.
+#
+# Each side is first reduced to a fixed number of bucket digests, with
+# principals hashed into buckets by name.  Only buckets whose digests differ
+# are then re-read in full, so memory use is proportional to the differences
+# rather than to the size of the database.
+
+import argparse
+import hashlib
+import multiprocessing
+import zlib
+
+from kdb import DumpRecord, NameFilter, dump_records, kadmin_records
+
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+
+NBUCKETS = 1 << 16
+
+Source = Callable[[NameFilter], Iterator[DumpRecord]]
+
+# A spec is ("dump", path) or ("kadmin", command line).  Both kinds of
+# source produce protocol numbers, so they can be compared with each other.
+Spec = Tuple[str, str]
+
+def make_source(spec: Spec) -> Source:
+    kind, value = spec
+    if kind == "kadmin":
+        return lambda keep: kadmin_records(value, keep)
+    return lambda keep: dump_records(value, keep)
+
+# These need to be stable across processes (the two sides are digested in
+# parallel), so Python's own salted hash() won't do.
+def bucket(name: str) -> int:
+    return zlib.crc32(name.encode("utf-8")) % NBUCKETS
+
+def normalize(record: DumpRecord) -> Tuple[int, Tuple[Tuple[int, int], ...]]:
+    _, kvno, keys = record
+    return kvno, tuple(sorted(keys))
+
+def princ_digest(record: DumpRecord) -> int:
+    name, kvno, keys = record
+    keysalts = [f"{et}:{salt}" for et, salt in sorted(keys)]
+    text = " ".join([name, str(kvno)] + keysalts)
+    data = text.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(),
+                          "big")
+
+# Bucket digests are order-independent sums, so the two sides can list
+# principals in any order.
+def bucket_digests(spec: Spec) -> List[int]:
+    digests = [0] * NBUCKETS
+    for record in make_source(spec)(None):
+        b = bucket(record[0])
+        digests[b] = (digests[b] + princ_digest(record)) % (1 << 64)
+    return digests
+
+def load(source: Source, buckets: Set[int]) \
+        -> Dict[str, Tuple[int, Tuple[Tuple[int, int], ...]]]:
+    keep = lambda name: bucket(name) in buckets
+    return {record[0]: normalize(record) for record in source(keep)}
+
+# Takes source specs (see make_source()).  Returns (missing from replica,
+# extra on replica, differing) principals.
+def compare(primary: Spec, replica: Spec) \
+        -> Tuple[List[str], List[str], List[str]]:
+    with multiprocessing.Pool(2) as pool:
+        a, b = pool.map(bucket_digests, [primary, replica])
+    differ = {i for i in range(NBUCKETS) if a[i] != b[i]}
+    if len(differ) == 0:
+        return [], [], []
+
+    pa = load(make_source(primary), differ)
+    pb = load(make_source(replica), differ)
+    missing = sorted(pa.keys() - pb.keys())
+    extra = sorted(pb.keys() - pa.keys())
+    diverging = sorted(p for p in pa.keys() & pb.keys() if pa[p] != pb[p])
+    return missing, extra, diverging
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare principal keys (kvno and enctype/salt) between "
+        "a primary and a replica KDB")
+    # Sources are given in order: primary first, then replica.
+    parser.add_argument("--dump", action="append", dest="sources",
+                        metavar="FILE", type=lambda v: ("dump", v),
+                        help="read principals from a kdb5_util dump")
+    parser.add_argument("--kadmin", action="append", dest="sources",
+                        metavar="COMMAND", type=lambda v: ("kadmin", v),
+                        help="read principals with a kadmin command line "
+                        "(e.g. \"kadmin.local\")")
+    args = parser.parse_args()
+    if args.sources is None or len(args.sources) != 2:
+        parser.error("exactly two sources (primary, then replica) are "
+                     "needed")
+
+    missing, extra, diverging = compare(*args.sources)
+    for princ in missing:
+        print(f"Missing from replica: {princ}")
+    for princ in extra:
+        print(f"Extra on replica: {princ}")
+    for princ in diverging:
+        print(f"Keys differ: {princ}")
+
+    if missing or extra or diverging:
+        exit(1)
+    print("Principal keys match")
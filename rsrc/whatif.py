@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+# Enctype deprecation planning: "if these enctypes (or salts) go away, which
+# principals are left with no usable key?"
+#
+# The principal x keysalt matrix is built once.  Each key is a bit in a
+# (canonical enctype x salt) space, and each principal's row is the OR of its
+# keys.  Principals with identical rows are grouped, so a what-if query is a
+# handful of mask operations per distinct row rather than a rescan of the
+# realm.
+
+import argparse
+
+from collections import defaultdict
+
+from audit import CATEGORIES, princ_category
+from enctypes import EnctypeError, canonicalize_et, canonicalize_etlist, \
+    ets, salts, split_keysalt, splitre, strip_deprecated
+from kdb import BadKeys, dump_princs, kadmin_princs
+
+from typing import DefaultDict, Dict, Iterable, List, Optional, Set, Tuple
+
+et_list = sorted(ets)
+salt_list = sorted(salts)
+
+def bit(et: str, salt: str) -> int:
+    return 1 << (et_list.index(et) * len(salt_list) + salt_list.index(salt))
+
+et_bits = {et: sum(bit(et, s) for s in salt_list) for et in et_list}
+salt_bits = {s: sum(bit(et, s) for et in et_list) for s in salt_list}
+all_bits = (1 << (len(et_list) * len(salt_list))) - 1
+
+def ks_mask(raw: str) -> int:
+    mask = 0
+    for ks in splitre.split(raw):
+        et, salt = split_keysalt(strip_deprecated(ks))
+        # e.g. kadmin's "<Salt type 0x6>" for types it doesn't know
+        if salt not in salts:
+            raise EnctypeError(f"salt type {salt} is not recognized by krb5!")
+        for canon in canonicalize_et(et):
+            mask |= bit(canon, salt)
+
+    return mask
+
+class KeyMatrix:
+    def __init__(self, princs: Iterable[Tuple[str, str]]) -> None:
+        # (category, row) -> principals
+        self.rows: DefaultDict[Tuple[str, int], List[str]] = \
+            defaultdict(list)
+        self.total = 0
+        # Principals whose keys couldn't be understood: (principal, reason)
+        self.errors: List[Tuple[str, str]] = []
+
+        for princ, kslist in princs:
+            # As in audit_princs(), there's nothing to say about these.
+            if kslist.strip() == "":
+                continue
+            if isinstance(kslist, BadKeys):
+                self.errors.append((princ, str(kslist)))
+                continue
+
+            category, _ = princ_category(princ)
+            try:
+                row = ks_mask(kslist)
+            except EnctypeError as e:
+                self.errors.append((princ, str(e)))
+                continue
+
+            self.rows[(category, row)].append(princ)
+            self.total += 1
+
+    # removed_ets are krb5 enctype names (aliases such as "des" are fine).
+    def allowed(self, removed_ets: str = "",
+                removed_salts: Optional[Set[str]] = None) -> int:
+        mask = all_bits
+        if removed_ets.strip():
+            for et in canonicalize_etlist(removed_ets.strip()):
+                mask &= ~et_bits[et]
+        for salt in removed_salts or set():
+            mask &= ~salt_bits[salt]
+        return mask
+
+    # Returns category -> principals with no remaining key.
+    def lost(self, removed_ets: str = "",
+             removed_salts: Optional[Set[str]] = None) -> Dict[str, List[str]]:
+        mask = self.allowed(removed_ets, removed_salts)
+        ret: Dict[str, List[str]] = {c: [] for c in CATEGORIES}
+        for (category, row), princs in self.rows.items():
+            if row & mask == 0:
+                ret[category] += princs
+        return ret
+
+def report(lost: Dict[str, List[str]], verbose: bool) -> None:
+    total = sum(len(v) for v in lost.values())
+    print(f"{total} principal(s) would have no usable keys")
+    for category in CATEGORIES:
+        princs = sorted(lost[category])
+        print(f"    {category}: {len(princs)}")
+        if verbose:
+            for princ in princs:
+                print(f"        {princ}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find principals that would lose every usable key if "
+        "enctypes or salt types were removed")
+    parser.add_argument("--dump", metavar="FILE",
+                        help="read principals from a kdb5_util dump instead "
+                        "of kadmin.local")
+    parser.add_argument("-r", "--remove", action="append", default=[],
+                        metavar="ENCTYPES",
+                        help="enctypes to remove; may be repeated to "
+                        "evaluate several policies")
+    parser.add_argument("-s", "--remove-salts", default="",
+                        metavar="SALTS",
+                        help="salt types to remove from every policy")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="list affected principals")
+    args = parser.parse_args()
+
+    removed_salts = set(splitre.split(args.remove_salts.strip())) - {""}
+    for salt in removed_salts - salts:
+        print(f"salt type {salt} is not recognized by krb5!")
+        exit(1)
+
+    matrix = KeyMatrix(dump_princs(args.dump) if args.dump
+                       else kadmin_princs())
+    print(f"{matrix.total} principal(s), {len(matrix.rows)} distinct key "
+          "profile(s)")
+    for princ, reason in matrix.errors:
+        print(f"Skipped {princ}: {reason}")
+
+    for removed in args.remove or [""]:
+        print(f"\nRemoving: {removed or '(nothing)'}")
+        try:
+            lost = matrix.lost(removed, removed_salts)
+        except EnctypeError as e:
+            print(e)
+            exit(1)
+        report(lost, args.verbose)